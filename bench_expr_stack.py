@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Stress benchmark for the decoder's expression stack. Builds synthetic
+# bytecode with deeply nested, wide function calls, runs it through
+# print_cmd, and checks the decompiled result.
+#
+# Usage: bench_expr_stack.py [depth] [width]
+
+import struct
+import sys
+import time
+
+import script_parser
+from script_parser import ExprStack, EndOfFileStatement, print_cmd
+
+FUNC_NAME = 'f'
+
+def setup_string_table():
+    # print_cmd looks up function names through get_string, which reads the
+    # string table out of script_parser.fsb. Give it a table with one string.
+    str_table_offset = 0x10
+    string_addr = str_table_offset + 4
+    fsb = bytearray(str_table_offset)
+    fsb += struct.pack('<L', string_addr)
+    fsb += FUNC_NAME.encode('mskanji') + b'\0'
+    script_parser.fsb = bytes(fsb)
+    script_parser.ptr_size = 4
+    script_parser.str_count = 1
+    script_parser.str_table_offset = str_table_offset
+
+def int_literal(num):
+    # 0D F0 followed by a little-endian base-128 varint, with the sign in the
+    # low bit. Values are fixed point with 10 fractional bits.
+    v = (num * 0x400) << 1
+    b = bytearray(b'\x0D\xF0')
+    while v >= 0x80:
+        b.append(0x80 | (v & 0x7F))
+        v >>= 7
+    b.append(v)
+    return bytes(b)
+
+def build_bytecode(depth, width):
+    """
+    Builds `depth` nested calls to FUNC_NAME. Each call takes `width` integer
+    literals, followed by the next call in (if there is one).
+    """
+    b = bytearray()
+    for _ in range(depth):
+        b += b'\x0D\xF1\x00\x00'
+        b += b'\x23'
+        for i in range(width):
+            b += int_literal(i)
+    b += b'\x24' * depth
+    b += b'\x27'
+    b += b'\x45'
+    return bytes(b)
+
+def expected_str(depth, width):
+    # Built inside-out without recursion, since str() on the decoded tree
+    # recurses once per nesting level
+    s = ''
+    for _ in range(depth):
+        args = [str(i) for i in range(width)]
+        if s:
+            args.append(s)
+        s = f"{FUNC_NAME}({', '.join(args)})"
+    return s + ';'
+
+def decode(bytecode):
+    expressions = ExprStack()
+    statements = []
+    offset = 0
+    while len(statements) == 0 or not isinstance(statements[-1][1], EndOfFileStatement):
+        offset = print_cmd(bytecode, offset, expressions, statements)
+    expressions.check_empty(statements[-1][0])
+    return statements
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    setup_string_table()
+
+    # Check the output on shapes small enough to stringify
+    for (d, w) in [(1, 0), (3, 2), (5, 3), (50, 5)]:
+        statements = decode(build_bytecode(d, w))
+        assert len(statements) == 2
+        actual = str(statements[0][1])
+        assert actual == expected_str(d, w), f'wrong output for depth {d}, width {w}: {actual}'
+
+    bytecode = build_bytecode(depth, width)
+    start = time.perf_counter()
+    statements = decode(bytecode)
+    elapsed = time.perf_counter() - start
+    assert len(statements) == 2
+    print(f'depth {depth}, width {width}: {len(bytecode)} bytes decoded in {elapsed:.3f}s')
+
+if __name__ == '__main__':
+    main()
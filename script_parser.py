@@ -352,17 +352,74 @@ class Block:
         s += "')"
         return s
 
+# Expression stack used while decoding
+
+class ExprStack:
+    """
+    The decoder's expression stack. Values live in one flat list (with their
+    offsets in a parallel list), and each 0x23 pushes the index where its
+    argument list starts onto a separate frame stack. That way 0x24 can take
+    all of its arguments as a single slice, without searching for the frame.
+    """
+    def __init__(self):
+        self.offsets = []
+        self.values = []
+        # Index into self.values where each open argument list starts, and
+        # the offset of the 0x23 command that opened it
+        self.frame_starts = []
+        self.frame_offsets = []
+
+    def append(self, expr):
+        (expr_offset, node) = expr
+        self.offsets.append(expr_offset)
+        self.values.append(node)
+
+    def pop(self, offset):
+        # Values below the innermost open frame belong to the enclosing
+        # expression, so a command inside an argument list can't consume them
+        base = self.frame_starts[-1] if self.frame_starts else 0
+        if len(self.values) <= base:
+            if self.frame_starts:
+                raise RuntimeError(f'Expression stack underflow at offset {offset:04X} ' \
+                                   f'(inside argument list opened at {self.frame_offsets[-1]:04X})')
+            raise RuntimeError(f'Expression stack underflow at offset {offset:04X}')
+        return (self.offsets.pop(), self.values.pop())
+
+    def open_frame(self, offset):
+        self.frame_starts.append(len(self.values))
+        self.frame_offsets.append(offset)
+
+    def close_frame(self, offset):
+        if not self.frame_starts:
+            raise RuntimeError(f'Argument list closed at offset {offset:04X} was never opened')
+        start = self.frame_starts.pop()
+        self.frame_offsets.pop()
+        args = self.values[start:]
+        del self.values[start:]
+        del self.offsets[start:]
+        return args
+
+    def check_empty(self, offset):
+        if self.frame_offsets:
+            opened = ', '.join(f'{o:04X}' for o in self.frame_offsets)
+            raise RuntimeError(f'Argument lists opened at offsets {opened} ' \
+                               f'are still open at offset {offset:04X}')
+        if self.values:
+            pushed = ', '.join(f'{o:04X}' for o in self.offsets)
+            raise RuntimeError(f'Expressions pushed at offsets {pushed} ' \
+                               f'are still on the stack at offset {offset:04X}')
+
 def print_cmd(file, offset, expr_stack, stmt_list):
     cmd = file[offset]
     # print(f'DEBUG: file[0x{offset:X}] = 0x{cmd:02X}')
     match cmd:
         case 0x01:
-            node = NegateNode(expr_stack[-1][1])
-            expr_stack[-1] = (expr_stack[-1][0], node)
+            (expr_offset, expr) = expr_stack.pop(offset)
+            expr_stack.append((expr_offset, NegateNode(expr)))
             return offset + 1
         case 0x07:
-            node = LogicalNotNode(expr_stack[-1][1])
-            expr_stack[-1] = (expr_stack[-1][0], node)
+            (expr_offset, expr) = expr_stack.pop(offset)
+            expr_stack.append((expr_offset, LogicalNotNode(expr)))
             return offset + 1
         case 0x0D:
             subcmd = file[offset+1]
@@ -404,72 +461,67 @@ def print_cmd(file, offset, expr_stack, stmt_list):
                 case _:
                     raise RuntimeError(f'unimplemented command 0D {subcmd:02X} at offset {offset:04X}')
         case 0x0F:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd0FNode(lhs[1], rhs[1])))
             return offset + 1
         case 0x12:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd12Node(lhs[1], rhs[1])))
             return offset + 1
         case 0x15:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd15Node(lhs[1], rhs[1])))
             return offset + 1
         case 0x16:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd16Node(lhs[1], rhs[1])))
             return offset + 1
         case 0x1A:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd1ANode(lhs[1], rhs[1])))
             return offset + 1
         case 0x1B:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd1BNode(lhs[1], rhs[1])))
             return offset + 1
         case 0x1C:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd1CNode(lhs[1], rhs[1])))
             return offset + 1
         case 0x1D:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd1DNode(lhs[1], rhs[1])))
             return offset + 1
         case 0x1E:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd1ENode(lhs[1], rhs[1])))
             return offset + 1
         case 0x1F:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd1FNode(lhs[1], rhs[1])))
             return offset + 1
         case 0x20:
-            rhs = expr_stack.pop()
-            lhs = expr_stack.pop()
+            rhs = expr_stack.pop(offset)
+            lhs = expr_stack.pop(offset)
             expr_stack.append((lhs[0], Cmd20Node(lhs[1], rhs[1])))
             return offset + 1
         case 0x23:
-            expr_stack.append((offset, FunctionArgsNode([])))
+            expr_stack.open_frame(offset)
             return offset + 1
         case 0x24:
-            i = len(expr_stack)
-            while not isinstance(expr_stack[i - 1][1], FunctionArgsNode):
-                i -= 1
-            expr_stack[i - 1][1].children = [expr[1] for expr in expr_stack[i:]]
-            del expr_stack[i:]
-            args = expr_stack.pop()
-            func = expr_stack.pop()
-            expr_stack.append((func[0], FunctionCallNode(func[1], args[1])))
+            args = expr_stack.close_frame(offset)
+            func = expr_stack.pop(offset)
+            expr_stack.append((func[0], FunctionCallNode(func[1], FunctionArgsNode(args))))
             return offset + 1
         case 0x25:
             stmt_list.append((offset, InitStatementNode()))
@@ -478,7 +530,7 @@ def print_cmd(file, offset, expr_stack, stmt_list):
             stmt_list.append((offset, EndStatementNode()))
             return offset + 1
         case 0x27:
-            expr = expr_stack.pop()
+            expr = expr_stack.pop(offset)
             stmt_list.append((expr[0], ExprStmtNode(expr[1])))
             return offset + 1
         case 0x28:
@@ -517,12 +569,12 @@ def print_cmd(file, offset, expr_stack, stmt_list):
         # Haven't seen this get used yet
         # case 0x36:
         #     (branch_offset,) = struct.unpack_from('<h', buffer=file, offset=offset+1)
-        #     cond = expr_stack.pop()
+        #     cond = expr_stack.pop(offset)
         #     stmt_list.append((cond[0], TrueGotoStatement(cond[1], offset + 3 + branch_offset)))
         #     return offset + 3
         case 0x37:
             (branch_offset,) = struct.unpack_from('<h', buffer=file, offset=offset+1)
-            cond = expr_stack.pop()
+            cond = expr_stack.pop(offset)
             stmt_list.append((cond[0], FalseGotoStatement(cond[1], offset + 3 + branch_offset)))
             return offset + 3
         case 0x45:
@@ -539,115 +591,127 @@ def get_string(id):
     # Characters like ⑲ don't exist in the 'shift_jis' encoding, so the distinction is important
     return fsb[string_addr:string_end_addr].decode('mskanji')
 
+# Script file contents and string table info, used by get_string. These are set
+# up by main() before any commands are decoded.
 fsb = None
-with open('../999_files/root/scr/b32.fsb', 'rb') as f:
-    fsb = f.read()
-
-assert fsb[0:3] == b'SIR'
-
-if fsb[3] == ord('0'):
-    ptr_size = 4
-elif fsb[3] == ord('1'):
-    ptr_size = 8
-    raise RuntimeError("SIR1 scripts are unsupported for now")
-
-# We could verify the pointer metadata... or we could just ignore it because we
-# know what the pointers are anyway
-script_header_offset = int.from_bytes(fsb[4:4+ptr_size], byteorder='little')
-# ptr_metadata_offset = int.from_bytes(fsb[4+ptr_size:4+ptr_size*2], byteorder='little')
-
-(filename_offset, entrypoint_dict_offset, str_count, str_table_offset, \
-    label_table_offset, variable_table_offset) \
-    = struct.unpack_from('<LLLLLL', buffer=fsb, offset=script_header_offset)
-
-# The filename is null-terminated
-filename_end_offset = fsb.index(0, filename_offset)
-filename = fsb[filename_offset:filename_end_offset].decode('ascii')
-# Add a .txt extension
-filename = filename + '.txt'
-print('Output file name:', filename)
-
-entrypoints = {}
-while True:
-    addr, name = struct.unpack_from('<LL', buffer=fsb, offset=entrypoint_dict_offset)
-    entrypoint_dict_offset += 8
-    if addr == 0 and name == 0:
-        break
-    name_end = fsb.index(0, name)
-    name_str = fsb[name:name_end].decode('mskanji')
-    assert addr not in entrypoints
-    entrypoints[addr] = name_str
-# print(entrypoints)
-
-with open(filename, 'w', encoding='utf-8') as f:
-    # Decompile all statements
-    addr = 0x10
-    statements = []
-    expressions = []
-    while len(statements) == 0 or not isinstance(statements[-1][1], EndOfFileStatement):
-        addr = print_cmd(fsb, addr, expressions, statements)
-    assert len(expressions) == 0
-    
-    
-    # Get the list of all the places where a node of the CFG starts
-    leaders = set(entrypoints)
-    for (i, (addr, stmt)) in enumerate(statements):
-        if stmt.is_branch():
-            leaders.add(stmt.branch_offset)
-            # The fallthrough to the next statement after a conditional branch also begins a node
-            if stmt.is_conditional_branch():
-                leaders.add(statements[i + 1][0])
-    leaders = list(leaders)
-    leaders.sort()
-    
-    # print(leaders)
-    # raise RuntimeError("that's all the leaders")
-
-    statements = dict(statements)
-    
-    # Create and populate blocks (control flow graph nodes) with statements
-    blocks = []
-    i = 0
-    statements_iter = iter(statements.items())
-    addr, stmt = next(statements_iter)
-    for i in range(len(leaders)):
-        block = Block()
-        assert addr == leaders[i]
-        while (i != len(leaders) - 1 and addr < leaders[i + 1]) or \
-              (i == len(leaders) - 1 and not isinstance(stmt, EndOfFileStatement)):
-            block.append(stmt)
-            addr, stmt = next(statements_iter)
-        # Add references to other blocks
-        last_stmt = block.statements[-1]
-        # Add fallthrough reference for blocks that end with normal statements and conditional branches
-        if (last_stmt.is_branch() and last_stmt.is_conditional_branch()) or \
-           (not last_stmt.is_branch() and not isinstance(last_stmt, EndStatementNode)):
-            block.fallthrough_target = i + 1
-            assert 0 <= block.fallthrough_target < len(leaders)
-        if last_stmt.is_branch():
-            block.branch_target = bisect.bisect_left(leaders, last_stmt.branch_offset)
-            assert leaders[block.branch_target] == last_stmt.branch_offset
-        blocks.append(block)
-        
-        # DEBUG
-        # print(f'BLOCK {i} (from addr {addr:04X})')
-        # print(block)
-        # input()
-        # END DEBUG
-    del addr
-    del stmt
-    del statements_iter
-    del i
-    
-    # for (i, block) in enumerate(blocks):
-    #     print('BLOCK', i)
-    #     print(block)
-    
-    # raise RuntimeError("We got this far")
-    
-    for (addr, statement) in statements.items():
-        func_name = entrypoints.get(addr)
-        if func_name is not None:
-            f.write(f'function {func_name}:\n')
-        f.write(f'\t/* 0x{addr:04X} */ {str(statement)}\n')
-    f.write('// There should be an "EOF" comment immediately before this comment')
+ptr_size = 4
+str_count = 0
+str_table_offset = 0
+
+def main():
+    global fsb, ptr_size, str_count, str_table_offset
+
+    with open('../999_files/root/scr/b32.fsb', 'rb') as f:
+        fsb = f.read()
+
+    assert fsb[0:3] == b'SIR'
+
+    if fsb[3] == ord('0'):
+        ptr_size = 4
+    elif fsb[3] == ord('1'):
+        ptr_size = 8
+        raise RuntimeError("SIR1 scripts are unsupported for now")
+
+    # We could verify the pointer metadata... or we could just ignore it because we
+    # know what the pointers are anyway
+    script_header_offset = int.from_bytes(fsb[4:4+ptr_size], byteorder='little')
+    # ptr_metadata_offset = int.from_bytes(fsb[4+ptr_size:4+ptr_size*2], byteorder='little')
+
+    (filename_offset, entrypoint_dict_offset, str_count, str_table_offset, \
+        label_table_offset, variable_table_offset) \
+        = struct.unpack_from('<LLLLLL', buffer=fsb, offset=script_header_offset)
+
+    # The filename is null-terminated
+    filename_end_offset = fsb.index(0, filename_offset)
+    filename = fsb[filename_offset:filename_end_offset].decode('ascii')
+    # Add a .txt extension
+    filename = filename + '.txt'
+    print('Output file name:', filename)
+
+    entrypoints = {}
+    while True:
+        addr, name = struct.unpack_from('<LL', buffer=fsb, offset=entrypoint_dict_offset)
+        entrypoint_dict_offset += 8
+        if addr == 0 and name == 0:
+            break
+        name_end = fsb.index(0, name)
+        name_str = fsb[name:name_end].decode('mskanji')
+        assert addr not in entrypoints
+        entrypoints[addr] = name_str
+    # print(entrypoints)
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        # Decompile all statements
+        addr = 0x10
+        statements = []
+        expressions = ExprStack()
+        while len(statements) == 0 or not isinstance(statements[-1][1], EndOfFileStatement):
+            addr = print_cmd(fsb, addr, expressions, statements)
+        expressions.check_empty(statements[-1][0])
+
+
+        # Get the list of all the places where a node of the CFG starts
+        leaders = set(entrypoints)
+        for (i, (addr, stmt)) in enumerate(statements):
+            if stmt.is_branch():
+                leaders.add(stmt.branch_offset)
+                # The fallthrough to the next statement after a conditional branch also begins a node
+                if stmt.is_conditional_branch():
+                    leaders.add(statements[i + 1][0])
+        leaders = list(leaders)
+        leaders.sort()
+
+        # print(leaders)
+        # raise RuntimeError("that's all the leaders")
+
+        statements = dict(statements)
+
+        # Create and populate blocks (control flow graph nodes) with statements
+        blocks = []
+        i = 0
+        statements_iter = iter(statements.items())
+        addr, stmt = next(statements_iter)
+        for i in range(len(leaders)):
+            block = Block()
+            assert addr == leaders[i]
+            while (i != len(leaders) - 1 and addr < leaders[i + 1]) or \
+                  (i == len(leaders) - 1 and not isinstance(stmt, EndOfFileStatement)):
+                block.append(stmt)
+                addr, stmt = next(statements_iter)
+            # Add references to other blocks
+            last_stmt = block.statements[-1]
+            # Add fallthrough reference for blocks that end with normal statements and conditional branches
+            if (last_stmt.is_branch() and last_stmt.is_conditional_branch()) or \
+               (not last_stmt.is_branch() and not isinstance(last_stmt, EndStatementNode)):
+                block.fallthrough_target = i + 1
+                assert 0 <= block.fallthrough_target < len(leaders)
+            if last_stmt.is_branch():
+                block.branch_target = bisect.bisect_left(leaders, last_stmt.branch_offset)
+                assert leaders[block.branch_target] == last_stmt.branch_offset
+            blocks.append(block)
+
+            # DEBUG
+            # print(f'BLOCK {i} (from addr {addr:04X})')
+            # print(block)
+            # input()
+            # END DEBUG
+        del addr
+        del stmt
+        del statements_iter
+        del i
+
+        # for (i, block) in enumerate(blocks):
+        #     print('BLOCK', i)
+        #     print(block)
+
+        # raise RuntimeError("We got this far")
+
+        for (addr, statement) in statements.items():
+            func_name = entrypoints.get(addr)
+            if func_name is not None:
+                f.write(f'function {func_name}:\n')
+            f.write(f'\t/* 0x{addr:04X} */ {str(statement)}\n')
+        f.write('// There should be an "EOF" comment immediately before this comment')
+
+if __name__ == '__main__':
+    main()